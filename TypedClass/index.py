@@ -1,10 +1,53 @@
-from typing import Callable, Dict, Type, Tuple, Any
+from typing import Callable, Dict, Type, Tuple, Any, Optional, Union
 from inspect import signature
+from types import FunctionType
+import dis
+import functools
 import unittest
 
 
 TypeDefTypeof = (Type, Tuple[Type])
 
+# NOTE: Code object flags for "*args" and "**kwargs", used to count "validate_fn" arguments
+_CO_FLAGS = {name: flag for flag, name in dis.COMPILER_FLAG_NAMES.items()}
+_CO_VARARGS = _CO_FLAGS['VARARGS']
+_CO_VARKEYWORDS = _CO_FLAGS['VARKEYWORDS']
+
+# NOTE: Sentinel for attribute lookups where "None" is a valid value
+_MISSING = object()
+
+# NOTE: Error messages for "TypedClass.__setattr__", only formatted when raising
+_ERR_UNKNOWN_ATTRIBUTE = """
+    The attribute "{}" was not contained within the class annotations,
+    you may need to type hint this attribute in your class,
+    or this may be an incorrect spelling.
+    Available attributes on this class are "{}"
+"""
+_ERR_INVALID_TYPE = """
+    "{key}" {type_or_tuple_of_types} "{typeof}",
+    but a type of "{value_type}" was provided, with the exact value of "{value}"
+"""
+_ERR_IMMUTABLE = """
+    The attribute "{}" is immutable; it can't be changed.
+"""
+_ERR_IMMUTABLE_DEFAULT = """
+    The attribute "{}" is immutable; it can't be changed.
+    This attribute was initially set by a default value.
+"""
+_ERR_INVALID_CHOICE = """
+    The attribute "{}" was not one of the valid TypeDef "choices".
+    A type of "{}" was provided, with the exact value of "{}".
+    The available choices are "{}"
+"""
+_ERR_VALIDATE_FN_RESULT = """
+    A TypeDef "validate_fn" must return a "bool",
+    but the "validate_fn" for "{}" return a "{}"
+"""
+_ERR_VALIDATE_FN_FAILED = """
+    The attribute "{}" failed it's TypeDef "validate_fn".
+    A type of "{}" was provided, with the exact value of "{}"
+"""
+
 
 class TypeDef:
     """
@@ -39,13 +82,31 @@ class TypeDef:
         you should just use:
             value: str
         TypedClass will treat them the same.
+        attributes set from the arguments:
+            choices_set: "choices" as a "frozenset" for fast membership tests,
+                         or the "choices" list if any choice is unhashable,
+                         "None" when there are no "choices".
+        methods:
+            with_defaults: copy with defaults for any option left as "None",
+                           used by the TypedClass extensions.
     """
+    __slots__ = (
+        'typeof',
+        'required',
+        'immutable',
+        'choices',
+        'choices_set',
+        'validate_fn',
+        'convert',
+    )
+
     typeof: TypeDefTypeof
-    required: bool = None
-    immutable: bool = None
-    choices: list = None
-    validate_fn: Callable = None
-    convert: bool = None
+    required: bool
+    immutable: bool
+    choices: list
+    choices_set: Optional[Union[frozenset, list]]
+    validate_fn: Callable
+    convert: bool
 
     def __init__(
         self,
@@ -92,21 +153,36 @@ class TypeDef:
                     """.format(type(choice), choice))
 
         if validate_fn is not None:
-            if not isinstance(validate_fn, Callable):
+            if not callable(validate_fn):
                 raise TypeError("""
                     TypeDef "validate_fn" must be "Callable" or "None",
                     but a type of "{}" was provided, with the exact value of "{}"
                 """.format(type(validate_fn), validate_fn))
 
-            validate_fn_signature = signature(validate_fn)
-
-            arg_length = len(list(validate_fn_signature.parameters))
+            # NOTE: Plain functions are counted from their code object,
+            # which is much cheaper than building an "inspect.signature".
+            # Decorated functions ("__wrapped__") or ones with a custom "__signature__"
+            # still go through "inspect.signature", which follows them.
+            if (
+                validate_fn.__class__ is FunctionType
+                and not hasattr(validate_fn, '__wrapped__')
+                and not hasattr(validate_fn, '__signature__')
+            ):
+                validate_fn_code = validate_fn.__code__
+                arg_length = (
+                    validate_fn_code.co_argcount
+                    + validate_fn_code.co_kwonlyargcount
+                    + bool(validate_fn_code.co_flags & _CO_VARARGS)
+                    + bool(validate_fn_code.co_flags & _CO_VARKEYWORDS)
+                )
+            else:
+                arg_length = len(signature(validate_fn).parameters)
 
             if arg_length > 1:
                 raise ValueError("""
                     TypeDef "validate_fn" must only have one argument;
                     but "{}" arguments were found, with the exact value of "{}"
-                """.format(arg_length, list(validate_fn_signature.parameters)))
+                """.format(arg_length, list(signature(validate_fn).parameters)))
 
         if convert is not None:
             if not isinstance(convert, bool):
@@ -119,9 +195,31 @@ class TypeDef:
         self.required = required
         self.immutable = immutable
         self.choices = choices
+        self.choices_set = choices
+        if choices is not None:
+            try:
+                self.choices_set = frozenset(choices)
+            except TypeError:
+                # NOTE: Unhashable choices fall back to the list
+                pass
         self.validate_fn = validate_fn
         self.convert = convert
 
+    def with_defaults(self, required: bool = None, immutable: bool = None, convert: bool = None):
+        """
+            Copy of this TypeDef with the given defaults used for any option left as "None".
+            NOTE: This TypeDef was already validated, so the copy skips "__init__".
+        """
+        type_def = object.__new__(TypeDef)
+        type_def.typeof = self.typeof
+        type_def.required = required if self.required is None else self.required
+        type_def.immutable = immutable if self.immutable is None else self.immutable
+        type_def.choices = self.choices
+        type_def.choices_set = self.choices_set
+        type_def.validate_fn = self.validate_fn
+        type_def.convert = convert if self.convert is None else self.convert
+        return type_def
+
 
 class TypedClass:
     """
@@ -143,128 +241,184 @@ class TypedClass:
                 Invalid type
                 Invalid choice
                 Failed validate_fn
-    """
-    def __init__(self, **kwargs):
-        self.__attributes_with_defaults_keys = []
-
-        for key in self.annotations:
-            if hasattr(self, key):
-                self.__attributes_with_defaults_keys.append(key)
-
-        for key in kwargs:
-            if kwargs[key] is not None:
-                setattr(self, key, kwargs[key])
-
-        del self.__attributes_with_defaults_keys
-
-        unset_required_props = []
 
-        for key in self.annotations:
-            annotation_value = self.annotations[key]
-
-            if isinstance(annotation_value, TypeDef):
-                if annotation_value.required and not hasattr(self, key):
-                    unset_required_props.append(key)
+        NOTE: The annotations, TypeDef defaults and setters are resolved once per class in
+        "__init_subclass__" and stored on the class, so instances share them.
+    """
+    __typed_annotations__ = {}
+    __has_annotations__ = False
+    __setters__ = None
+    __default_keys__ = frozenset()
+    __required_keys__ = frozenset()
+    __base_setattr__ = object.__setattr__
+
+    def __init_subclass__(cls, **kwargs):
+        """
+            Resolve the class annotations once, so the lookup isn't repeated on every attribute set.
+            NOTE: A subclass without its own annotations inherits its parent's,
+            same as "__annotations__" would.
+        """
+        super().__init_subclass__(**kwargs)
+        # NOTE: Same "__setattr__" that "super()" would find,
+        # without building a "super" on every set
+        cls.__base_setattr__ = super(TypedClass, cls).__setattr__
+        if '__annotations__' in cls.__dict__:
+            cls.__has_annotations__ = True
+            cls.__typed_annotations__ = {
+                key: cls._apply_typedef_defaults(annotation_value)
+                for key, annotation_value in cls.__dict__['__annotations__'].items()
+            }
 
-        if unset_required_props:
-            raise AttributeError(
-                """
-                    Missing required attributes for keys {}
-                """.format(unset_required_props)
+        if cls.__has_annotations__:
+            cls.__default_keys__ = frozenset(
+                key for key in cls.__typed_annotations__ if hasattr(cls, key)
+            )
+            # NOTE: Required attributes with a default value are always set
+            cls.__required_keys__ = frozenset(
+                key for key, annotation_value in cls.__typed_annotations__.items()
+                if annotation_value.__class__ is TypeDef and annotation_value.required
+                and key not in cls.__default_keys__
             )
+            cls._build_setters()
 
-    def __setattr__(self, key, value):
-        if key == '_TypedClass__attributes_with_defaults_keys':
-            super().__setattr__(key, value)
-            return
+    @classmethod
+    def _apply_typedef_defaults(cls, annotation_value):
+        """
+            Called once per annotation when the class is created,
+            extensions override this to set their own TypeDef defaults.
+        """
+        return annotation_value
 
-        if key not in self.annotations:
-            raise AttributeError(
-                """
-                    The attribute "{}" was not contained within the class annotations,
-                    you may need to type hint this attribute in your class,
-                    or this may be an incorrect spelling.
-                    Available attributes on this class are "{}"
-                """.format(key, self.annotations)
-            )
+    @classmethod
+    def _build_setters(cls):
+        """
+            Pick the setter "__setattr__" dispatches to for each annotated attribute,
+            so only the checks that apply to that attribute are run.
+        """
+        setters = {}
+
+        for key, annotation_value in cls.__typed_annotations__.items():
+            if annotation_value.__class__ is TypeDef:
+                setters[key] = cls._typedef_setter(
+                    key,
+                    annotation_value,
+                    key in cls.__default_keys__
+                )
+            else:
+                setters[key] = cls._simple_setter(key, annotation_value)
 
-        annotation_value = self.annotations[key]
+        cls.__setters__ = setters
 
-        if isinstance(annotation_value, TypeDef):
-            if annotation_value.convert:
-                value = annotation_value.typeof(value)
+    @staticmethod
+    def _simple_setter(key, typeof):
+        """
+            Setter for a simple type hint (i.e. a "type" or "tuple" of "types"),
+            only validates the type.
+        """
+        if isinstance(typeof, tuple):
+            type_or_tuple_of_types = "must be one of"
+        else:
+            type_or_tuple_of_types = "must be a"
+
+        def setter(self, value):
+            if not isinstance(value, typeof):
+                raise TypeError(_ERR_INVALID_TYPE.format(
+                    key=key,
+                    type_or_tuple_of_types=type_or_tuple_of_types,
+                    typeof=typeof,
+                    value_type=type(value),
+                    value=value))
+            return value
 
-            if not isinstance(value, annotation_value.typeof):
-                raise TypeError("""
-                    "{key}" must be a "{typeof}",
-                    but a type of "{value_type}" was provided, with the exact value of "{value}"
-                """.format(
+        return setter
+
+    @staticmethod
+    def _typedef_setter(key, type_def, has_default):
+        """
+            Setter for a TypeDef, validates all of the TypeDef options that are set.
+        """
+        typeof = type_def.typeof
+        convert = bool(type_def.convert)
+        immutable = bool(type_def.immutable)
+        choices = type_def.choices_set
+        validate_fn = type_def.validate_fn
+
+        def setter(self, value):
+            if convert:
+                value = typeof(value)
+
+            if not isinstance(value, typeof):
+                raise TypeError(_ERR_INVALID_TYPE.format(
                     key=key,
-                    typeof=annotation_value.typeof,
+                    type_or_tuple_of_types="must be a",
+                    typeof=typeof,
                     value_type=type(value),
                     value=value))
 
-            if annotation_value.immutable:
+            if immutable:
                 if key in self.__dict__:
-                    raise AttributeError("""
-                        The attribute "{}" is immutable; it can't be changed.
-                    """.format(key))
+                    raise AttributeError(_ERR_IMMUTABLE.format(key))
                 # NOTE: Edge case here is that you can update an immutable
-                # value if it had a default value, but only once.
+                # value if it had a default value, but only once, while "__init__" is running.
                 # The code below fixes this possible issue.
-                elif annotation_value.immutable:
-                    invalid_immutable = False
-
-                    try:
-                        getattr(self, key)
-                        if not hasattr(self, '_TypedClass__attributes_with_defaults_keys') or key not in self.__attributes_with_defaults_keys:
-                            invalid_immutable = True
-                    except AttributeError:
-                        pass
-
-                    if invalid_immutable:
-                        raise AttributeError("""
-                            The attribute "{}" is immutable; it can't be changed.
-                            This attribute was initially set by a default value.
-                        """.format(key))
-
-            if annotation_value.choices is not None:
-                if value not in annotation_value.choices:
-                    raise TypeError("""
-                        The attribute "{}" was not one of the valid TypeDef "choices".
-                        A type of "{}" was provided, with the exact value of "{}".
-                        The available choices are "{}"
-                    """.format(key, type(value), value, annotation_value.choices))
-
-            if annotation_value.validate_fn is not None:
-                validate_fn_result = annotation_value.validate_fn(value)
+                elif has_default and '_TypedClass__initializing' not in self.__dict__:
+                    raise AttributeError(_ERR_IMMUTABLE_DEFAULT.format(key))
+
+            if choices is not None:
+                try:
+                    is_choice = value in choices
+                except TypeError:
+                    # NOTE: An unhashable value can't be one of the hashable choices
+                    is_choice = False
+
+                if not is_choice:
+                    raise TypeError(_ERR_INVALID_CHOICE.format(
+                        key, type(value), value, type_def.choices))
+
+            if validate_fn is not None:
+                validate_fn_result = validate_fn(value)
                 if not isinstance(validate_fn_result, bool):
-                    raise TypeError("""
-                        A TypeDef "validate_fn" must return a "bool", 
-                        but the "validate_fn" for "{}" return a "{}"
-                    """.format(key, type(validate_fn_result)))
+                    raise TypeError(_ERR_VALIDATE_FN_RESULT.format(key, type(validate_fn_result)))
                 elif not validate_fn_result:
-                    raise TypeError("""
-                        The attribute "{}" failed it's TypeDef "validate_fn".
-                        A type of "{}" was provided, with the exact value of "{}"
-                    """.format(key, type(value), value))
-        elif not isinstance(value, annotation_value):
-            if isinstance(annotation_value, tuple):
-                type_or_tuple_of_types = "must be one of"
-            else:
-                type_or_tuple_of_types = "must be a"
+                    raise TypeError(_ERR_VALIDATE_FN_FAILED.format(key, type(value), value))
 
-            raise TypeError("""
-                "{key}" {type_or_tuple_of_types} "{typeof}",
-                but a type of "{value_type}" was provided, with the exact value of "{value}"
-            """.format(
-                key=key,
-                type_or_tuple_of_types=type_or_tuple_of_types,
-                typeof=annotation_value,
-                value_type=type(value),
-                value=value))
+            return value
+
+        return setter
+
+    def __init__(self, **kwargs):
+        # NOTE: Raises the missing annotations error before any attribute is set
+        annotations = self.annotations
 
-        super().__setattr__(key, value)
+        # NOTE: Only marks that "__init__" is running, see the immutable check in "_typedef_setter"
+        object.__setattr__(self, '_TypedClass__initializing', True)
+
+        for key, value in kwargs.items():
+            if value is not None:
+                setattr(self, key, value)
+
+        object.__delattr__(self, '_TypedClass__initializing')
+
+        unset_required_keys = type(self).__required_keys__ - self.__dict__.keys()
+
+        if unset_required_keys:
+            unset_required_props = [key for key in annotations if key in unset_required_keys]
+            raise AttributeError(
+                """
+                    Missing required attributes for keys {}
+                """.format(unset_required_props)
+            )
+
+    def __setattr__(self, key, value):
+        # NOTE: "setattr" already interns "key" before calling this, even for keys from parsed json,
+        # so the lookups below get the identity fast path without a "sys.intern" here.
+        setter = type(self).__setters__.get(key)
+
+        if setter is None:
+            raise AttributeError(_ERR_UNKNOWN_ATTRIBUTE.format(
+                key, list(type(self).__typed_annotations__)))
+
+        type(self).__base_setattr__(self, key, setter(self, value))
 
     def __delattr__(self, key):
         if key in self.annotations:
@@ -277,13 +431,17 @@ class TypedClass:
 
     @property
     def attributes(self) -> Dict[str, Any]:
+        instance_dict = self.__dict__
+        cls = type(self)
         result = {}
         for key in self.annotations:
-            try:
-                value = getattr(self, key)
-                result[key] = value
-            except AttributeError:
-                pass
+            if key in instance_dict:
+                result[key] = instance_dict[key]
+            else:
+                # NOTE: Attributes that were never set can still have a class default
+                value = getattr(cls, key, _MISSING)
+                if value is not _MISSING:
+                    result[key] = value
         return result
 
     @property
@@ -291,15 +449,14 @@ class TypedClass:
         """
             NOTE: __annotations__ is not on the class if the child class doesn't use any
         """
-        try:
-            return getattr(self, '__annotations__')
-        except AttributeError:
+        if not type(self).__has_annotations__:
             raise AttributeError(
                 """
                     While using "TypedClass" you must provide annotations on your class.
                     (i.e. type hints)
                 """
             )
+        return type(self).__typed_annotations__
 
     @property
     def dict(self) -> dict:
@@ -310,10 +467,9 @@ class TypedClass:
             :return: dict
         """
         result = {}
-        for key in self.attributes:
-            value = self.attributes[key]
-            if hasattr(value, 'attributes'):
-                result[key] = value.attributes
+        for key, value in self.attributes.items():
+            if isinstance(value, TypedClass):
+                result[key] = value.dict
             else:
                 result[key] = value
         return result
@@ -326,35 +482,16 @@ class TypedClassStrict(TypedClass):
         with the required and immutable props set to "True" by default.
         see TypedClass for details.
     """
-    def __init__(self, **kwargs):
-        for key in self.annotations:
-            annotation_value = self.annotations[key]
-            if isinstance(annotation_value, TypeDef):
-                if annotation_value.required is not None:
-                    required = annotation_value.required
-                else:
-                    required = True
-
-                if annotation_value.immutable is not None:
-                    immutable = annotation_value.immutable
-                else:
-                    immutable = True
-
-                self.annotations[key] = TypeDef(
-                    typeof=annotation_value.typeof,
-                    required=required,
-                    immutable=immutable,
-                    choices=annotation_value.choices,
-                    validate_fn=annotation_value.validate_fn,
-                    convert=annotation_value.convert
-                )
-            else:
-                self.annotations[key] = TypeDef(
-                    typeof=annotation_value,
-                    required=True,
-                    immutable=True
-                )
-        super().__init__(**kwargs)
+    @classmethod
+    def _apply_typedef_defaults(cls, annotation_value):
+        annotation_value = super()._apply_typedef_defaults(annotation_value)
+        if annotation_value.__class__ is TypeDef:
+            return annotation_value.with_defaults(required=True, immutable=True)
+        return TypeDef(
+            typeof=annotation_value,
+            required=True,
+            immutable=True
+        )
 
 
 class TypedClassJson(TypedClassStrict):
@@ -364,31 +501,19 @@ class TypedClassJson(TypedClassStrict):
         with the "convert" props set to "True" by default.
         see TypedClassStrict for details.
     """
+    @classmethod
+    def _apply_typedef_defaults(cls, annotation_value):
+        if annotation_value.__class__ is TypeDef:
+            annotation_value = annotation_value.with_defaults(convert=True)
+        else:
+            annotation_value = TypeDef(
+                typeof=annotation_value,
+                convert=True
+            )
+        return super()._apply_typedef_defaults(annotation_value)
+
     def __init__(self, input_json_obj):
-        json_obj = input_json_obj.copy()
-        for key in self.annotations:
-            annotation_value = self.annotations[key]
-            if isinstance(annotation_value, TypeDef):
-                if annotation_value.convert is not None:
-                    convert = annotation_value.convert
-                else:
-                    convert = True
-                self.annotations[key] = TypeDef(
-                    typeof=annotation_value.typeof,
-                    required=annotation_value.required,
-                    immutable=annotation_value.immutable,
-                    choices=annotation_value.choices,
-                    validate_fn=annotation_value.validate_fn,
-                    convert=convert
-                )
-            else:
-                self.annotations[key] = TypeDef(
-                    typeof=annotation_value,
-                    required=True,
-                    immutable=True,
-                    convert=True
-                )
-        super().__init__(**json_obj)
+        super().__init__(**input_json_obj)
 
 
 TypeExampleAllOptions = (int, str, Callable, TypeDef, TypedClass)
@@ -499,6 +624,7 @@ class TestTypedClass(unittest.TestCase):
 
         json_output_example_2 = ExampleJSONValidationUsageWithHelperClass(example_json)
         self.assertEqual(example_json, json_output_example_2.dict)
+        self.assertIs(ExampleJSONValidationUsageWithHelperClass.__annotations__['_id'], int)
 
         example = ExampleTypedClass(
             simple_type_hint=23,
@@ -507,10 +633,86 @@ class TestTypedClass(unittest.TestCase):
             type_hint_with_default=24,
             all_options=23
         )
-        self.assertEqual(example.annotations, example.__annotations__)
+        self.assertEqual(example.annotations.keys(), example.__annotations__.keys())
+        self.assertIs(example.__annotations__['simple_type_hint'], int)
+        self.assertTrue(example.annotations['simple_type_hint'].required)
+        self.assertTrue(example.annotations['simple_type_hint'].immutable)
         self.assertEqual(example.type_hint, 23)
         self.assertEqual(example.attributes['simple_type_hint'], 23)
 
+    def test_choices(self):
+        """
+            def test_choices
+        """
+
+        class ExampleChoices(TypedClass):
+            flag: TypeDef(typeof=bool, choices=[True])
+            number: TypeDef(typeof=int, choices=[1, 2])
+            pair: TypeDef(typeof=list, choices=[[1, 2], [3, 4]])
+
+        example = ExampleChoices()
+
+        example.flag = True
+        with self.assertRaises(TypeError):
+            example.flag = 1
+
+        example.number = 2
+        example.number = True
+        self.assertIs(example.number, True)
+        with self.assertRaises(TypeError):
+            example.number = 1.0
+        with self.assertRaises(TypeError):
+            example.number = 3
+
+        example.pair = [3, 4]
+        with self.assertRaises(TypeError):
+            example.pair = [1, 3]
+        with self.assertRaises(TypeError):
+            example.pair = (1, 2)
+
+    def test_validate_fn_arguments(self):
+        """
+            def test_validate_fn_arguments
+        """
+
+        def is_positive(value):
+            return value > 0
+
+        @functools.wraps(is_positive)
+        def wrapped_is_positive(*args, **kwargs):
+            return is_positive(*args, **kwargs)
+
+        TypeDef(typeof=int, validate_fn=is_positive)
+        TypeDef(typeof=int, validate_fn=wrapped_is_positive)
+        TypeDef(typeof=int, validate_fn=lambda *values: True)
+
+        with self.assertRaises(ValueError):
+            TypeDef(typeof=int, validate_fn=lambda value, other: True)
+        with self.assertRaises(ValueError):
+            TypeDef(typeof=int, validate_fn=lambda value, *, other: True)
+        with self.assertRaises(ValueError):
+            TypeDef(typeof=int, validate_fn=lambda value, **others: True)
+
+    def test_dict_nested(self):
+        """
+            def test_dict_nested
+        """
+
+        class ExampleNestedWrapper(TypedClassJson):
+            wrapped: ExampleJSONValidationUsageWithHelperClass
+
+        example_json = {
+            'wrapped': {
+                '_id': 2,
+                'sender': 'nic',
+                'kind': 'message',
+                'nested_obj': {'name': 'a', 'value': 'b', 'valid': False},
+                'nested_obj_with_help': {'name': 'c', 'value': 'd', 'valid': True}
+            }
+        }
+
+        self.assertEqual(example_json, ExampleNestedWrapper(example_json).dict)
+
 
 if __name__ == '__main__':
     unittest.main()